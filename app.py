@@ -1,19 +1,95 @@
+import os
+import sys
+
+if __name__ == '__main__' and '--dev' not in sys.argv:
+    # Production: hand over to gunicorn (see gunicorn.conf.py) before any app
+    # setup runs, since gunicorn imports and initializes the app itself
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    os.execv(sys.executable, [
+        sys.executable, '-m', 'gunicorn',
+        '--chdir', base_dir,
+        '-c', os.path.join(base_dir, 'gunicorn.conf.py'),
+        'app:app'
+    ])
+
 from flask import Flask, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import orjson
 from zkp import SecureAgeZKProof
-import os
+from config import config
+import tempfile
 from datetime import datetime
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for faster request/response handling"""
+    
+    def _dumps_bytes(self, obj, **kwargs):
+        """Serialize to bytes, honouring the sort_keys and indent settings"""
+        option = 0
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option)
+    
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj, **kwargs).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        """Build a JSON response from orjson bytes without a str round trip"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self._dumps_bytes(obj, indent=indent) + b"\n", mimetype=self.mimetype
+        )
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Let the front-end server transfer QR files instead of the Python process
+app.config['USE_X_SENDFILE'] = config.QR_USE_X_SENDFILE
 
 # Configure CORS to specifically allow localhost:3000
 CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000"], 
      methods=["GET", "POST", "OPTIONS"],
      allow_headers=["Content-Type", "Authorization"])
 
-# Initialize the ZK proof system
-secret_key = os.urandom(32)  # In production, this should be stored securely
-age_prover = SecureAgeZKProof(secret_key, test_mode=False)
+def _check_secret_key(secret_key, source):
+    """Reject signing keys that are empty or too short"""
+    if len(secret_key) < config.SECRET_KEY_SIZE:
+        raise ValueError(f"Secret key from {source} must be at least {config.SECRET_KEY_SIZE} bytes")
+    return secret_key
+
+def _load_secret_key():
+    """Load the signing key from the environment, falling back to a key file"""
+    secret_hex = os.environ.get(config.SECRET_KEY_ENV)
+    if secret_hex is not None:
+        return _check_secret_key(bytes.fromhex(secret_hex), config.SECRET_KEY_ENV)
+    
+    # Create the key file once so restarts and workers keep the same key.
+    # The key is written to a temp file and linked into place, so no process
+    # ever reads a partially written key file.
+    if not os.path.exists(config.SECRET_KEY_FILE):
+        key_dir = os.path.dirname(os.path.abspath(config.SECRET_KEY_FILE))
+        fd, tmp_path = tempfile.mkstemp(dir=key_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(os.urandom(config.SECRET_KEY_SIZE).hex())
+            os.link(tmp_path, config.SECRET_KEY_FILE)
+        except FileExistsError:
+            pass  # another process published its key first
+        finally:
+            os.unlink(tmp_path)
+    
+    with open(config.SECRET_KEY_FILE) as f:
+        return _check_secret_key(bytes.fromhex(f.read().strip()), config.SECRET_KEY_FILE)
+
+# Initialize the ZK proof system; rotating the key requires restarting the app
+age_prover = SecureAgeZKProof(_load_secret_key(), test_mode=False)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -26,7 +102,7 @@ def health_check():
 
 @app.route('/qr-code/<path:filename>', methods=['GET'])
 def serve_qr_code(filename):
-    """Serve QR code images"""
+    """Serve QR code images (deprecated: /generate returns qr_data_url)"""
     try:
         # Security: ensure the filename is within the generated_qr_codes directory
         if '..' in filename or filename.startswith('/'):
@@ -35,18 +111,34 @@ def serve_qr_code(filename):
         # Construct the full path to the QR code file
         qr_code_path = os.path.join(age_prover.qr_folder, filename)
         
-        # Check if file exists
-        if not os.path.exists(qr_code_path):
-            return jsonify({'error': 'QR code not found'}), 404
+        # QR codes never change once written, so cache them until the proof expires.
+        # Each one carries a usable signed proof, so only the client may cache it.
+        max_age = int(age_prover.proof_expiry_hours * 3600)
+        
+        # Hand the transfer to nginx; it answers 404 for missing files itself
+        if config.QR_ACCEL_REDIRECT_PREFIX:
+            response = app.response_class(mimetype='image/png')
+            response.headers['X-Accel-Redirect'] = config.QR_ACCEL_REDIRECT_PREFIX + filename
+            response.cache_control.private = True
+            response.cache_control.max_age = max_age
+            response.cache_control.immutable = True
+            return response
         
-        # Serve the file with proper headers
-        return send_file(
+        # Serve the file with proper headers; a missing file surfaces from open()
+        response = send_file(
             qr_code_path,
             mimetype='image/png',
             as_attachment=False,
-            download_name=filename
+            download_name=filename,
+            max_age=max_age
         )
+        response.cache_control.public = False  # send_file marks max_age responses public
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+        return response
         
+    except FileNotFoundError:
+        return jsonify({'error': 'QR code not found'}), 404
     except Exception as e:
         return jsonify({'error': f'Failed to serve QR code: {str(e)}'}), 500
 
@@ -82,6 +174,43 @@ def verify_proof():
             'message': f'Verification error: {str(e)}'
         }), 500
 
+@app.route('/verify-batch', methods=['POST', 'OPTIONS'])
+def verify_proof_batch():
+    """Verify several ZK proofs in one request"""
+    # Handle preflight OPTIONS request
+    if request.method == 'OPTIONS':
+        response = jsonify({'status': 'ok'})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        return response
+    
+    try:
+        data = request.get_json()
+        
+        if not isinstance(data, dict) or not isinstance(data.get('proofs'), list):
+            return jsonify({'error': 'Missing required field: proofs (list)'}), 400
+        
+        proofs = data['proofs']
+        if len(proofs) > config.VERIFY_BATCH_MAX:
+            return jsonify({'error': f'At most {config.VERIFY_BATCH_MAX} proofs per batch'}), 400
+        
+        # Verify each proof using the ZK system
+        results = []
+        for proof_data in proofs:
+            is_valid, message = age_prover.verify_proof(proof_data)
+            results.append({'valid': is_valid, 'message': message})
+        
+        return jsonify({
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Verification error: {str(e)}'
+        }), 500
+
 @app.route('/generate', methods=['POST', 'OPTIONS'])
 def generate_proof():
     """Generate a new ZK proof"""
@@ -102,17 +231,25 @@ def generate_proof():
         birth_date = data['birth_date']
         user_id = data['user_id']
         
+        # Use one timestamp for the proof and its QR filename
+        now = datetime.now()
+        
         # Generate the proof
-        proof = age_prover.generate_secure_age_proof(birth_date, user_id)
+        proof = age_prover.generate_secure_age_proof(birth_date, user_id, now=now)
         
-        # Generate QR code
-        qr_filepath, alias = age_prover.generate_qr_code(proof)
+        # Encode the QR code in memory and return it inline as a data URL
+        qr_png = age_prover.render_qr_png(proof)
+        
+        # Write the same PNG for the deprecated /qr-code endpoint. This is one small
+        # write, and doing it before responding means any worker can serve the file.
+        qr_filepath, alias = age_prover.generate_qr_code(proof, now=now, png_data=qr_png)
         
         # Extract just the filename from the full path
         qr_filename = os.path.basename(qr_filepath)
         
         return jsonify({
             'proof': proof,
+            'qr_data_url': age_prover.qr_data_url(qr_png),
             'qr_code_path': qr_filename,  # Return just the filename
             'qr_full_path': qr_filepath,  # Keep full path for reference if needed
             'alias': alias,
@@ -134,10 +271,13 @@ def get_config():
     })
 
 if __name__ == '__main__':
-    print("Starting ZK Proof Authentication API...")
+    print("Starting ZK Proof Authentication API (development server)...")
     print("API will be available at: http://localhost:5001")
     print("Frontend should be configured to connect to this URL")
     print("CORS enabled for: http://localhost:3000")
     print("QR code images will be served from /qr-code/ endpoint")
     
+    # Remove QR code files once their proofs have expired
+    age_prover.start_qr_sweeper()
+    
     app.run(debug=True, host='0.0.0.0', port=5001)
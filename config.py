@@ -13,9 +13,19 @@ class Config:
         self.QR_FOLDER = "generated_qr_codes"
         self.QR_BOX_SIZE = 10
         self.QR_BORDER = 5
+        self.QR_COMPRESS_LEVEL = 1  # zlib level for QR PNGs; QR images barely shrink at higher levels
+        self.QR_USE_X_SENDFILE = False  # let Apache/lighttpd send QR files via X-Sendfile
+        self.QR_ACCEL_REDIRECT_PREFIX = None  # nginx internal location, e.g. "/qr-internal/"
+        self.QR_SWEEP_MIN_INTERVAL = 60  # minimum seconds between sweeps of expired QR files
+        
+        # Verification settings
+        self.VERIFY_BATCH_MAX = 100  # proofs accepted per /verify-batch request
+        self.VERIFY_CACHE_SIZE = 10_000  # recently verified proofs kept per prover
         
         # Security settings
         self.SECRET_KEY_SIZE = 32  # bytes
+        self.SECRET_KEY_ENV = "ZKP_SECRET_KEY"  # hex-encoded signing key
+        self.SECRET_KEY_FILE = "zkp_secret.key"  # used when the env var is unset
         
     def set_test_mode(self):
         """Enable test mode with shorter expiry times"""
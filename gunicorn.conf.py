@@ -0,0 +1,17 @@
+"""Gunicorn settings for running the ZK Proof API in production"""
+
+bind = "0.0.0.0:5001"
+workers = 4
+
+# Threaded workers overlap blocking QR file I/O across requests
+worker_class = "gthread"
+threads = 4
+
+# Load the app once so every worker shares the same prover secret key
+preload_app = True
+
+
+def when_ready(server):
+    """Remove QR code files once their proofs have expired"""
+    from app import age_prover
+    age_prover.start_qr_sweeper()
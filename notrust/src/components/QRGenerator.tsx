@@ -14,6 +14,7 @@ interface ProofData {
 
 interface GeneratedProofResponse {
   proof: ProofData;
+  qr_data_url?: string;
   qr_code_path: string;
   alias: string;
   message: string;
@@ -62,8 +63,12 @@ const QRGenerator: React.FC<QRGeneratorProps> = ({
         const result: GeneratedProofResponse = await response.json();
         setGeneratedProof(result);
 
-        // Load and display the QR code image
-        await loadQRCodeImage(result.qr_code_path);
+        // Display the inline QR code, falling back to fetching the image file
+        if (result.qr_data_url) {
+          setQrCodeImage(result.qr_data_url);
+        } else {
+          await loadQRCodeImage(result.qr_code_path);
+        }
       } else {
         const errorData = await response.json();
         setError(errorData.error || "Failed to generate proof");
@@ -52,7 +52,7 @@ echo ""
 # Start backend in background
 echo "🔧 Starting Flask backend..."
 cd ..
-python3 app.py &
+python3 app.py --dev &
 BACKEND_PID=$!
 
 # Wait a moment for backend to start
@@ -1,16 +1,36 @@
 import hashlib
 import os
-import random
-import qrcode
+from collections import OrderedDict
+import segno
 from datetime import datetime, date, timedelta
-import json
+import orjson
 import hmac
+import secrets
 import base64
+import io
+import logging
+import re
+import threading
+import time
 from config import config
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Strict YYYY-MM-DD birth date format
+BIRTH_DATE_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
 class SecureAgeZKProof:
+    # Fixed field order for signing; !r keeps field types and boundaries unambiguous
+    _SIGN_FMT = "v1|{alias!r}|{user_id!r}|{age_verified!r}|{min_age!r}|{timestamp!r}|{expires_at!r}"
+    
     def __init__(self, secret_key=None, test_mode=False):
         self.secret_key = secret_key or os.urandom(config.SECRET_KEY_SIZE)
+        self._init_hmac_pads()
         self.min_age = config.MIN_AGE
         
         # Set mode (test or production)
@@ -22,32 +42,93 @@ class SecureAgeZKProof:
         self.proof_expiry_hours = config.PROOF_EXPIRY_HOURS
         self.qr_folder = config.QR_FOLDER
         self._ensure_qr_folder()
+        
+        # Recently verified proofs: signature -> (signed bytes, result)
+        self._verify_cache = OrderedDict()
+        self._verify_cache_max = config.VERIFY_CACHE_SIZE
+        self._verify_lock = threading.Lock()
     
     def _ensure_qr_folder(self):
-        """Create QR codes folder if it doesn't exist"""
-        if not os.path.exists(self.qr_folder):
-            os.makedirs(self.qr_folder)
+        """Create QR codes folder once at startup so writes never need to check"""
+        os.makedirs(self.qr_folder, exist_ok=True)
+    
+    def sweep_expired_qr_codes(self):
+        """Delete QR code files older than the proof expiry, returning how many were removed"""
+        cutoff = time.time() - self.proof_expiry_hours * 3600
+        removed = 0
+        with os.scandir(self.qr_folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith(('.png', '.tmp')):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass  # removed by another process
+        return removed
+    
+    def start_qr_sweeper(self):
+        """Periodically remove expired QR code files on a daemon thread"""
+        interval = max(config.QR_SWEEP_MIN_INTERVAL, self.proof_expiry_hours * 3600 / 4)
+        lock_path = os.path.join(self.qr_folder, ".sweep.lock")
+        
+        def sweep_forever():
+            while True:
+                try:
+                    with open(lock_path, "a") as lock_file:
+                        # Only one process sweeps at a time; the others skip this round
+                        if fcntl is not None:
+                            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        self.sweep_expired_qr_codes()
+                except BlockingIOError:
+                    pass  # another process holds the lock and is sweeping
+                except Exception:
+                    logger.exception("Failed to sweep expired QR codes in %s", self.qr_folder)
+                time.sleep(interval)
+        
+        thread = threading.Thread(target=sweep_forever, name="qr-sweeper", daemon=True)
+        thread.start()
+        return thread
     
     def _generate_alias(self):
-        """Generate a random 5-digit alias"""
-        return f"{random.randint(10000, 99999)}"
+        """Generate an unguessable 8-hex-digit alias"""
+        return secrets.token_hex(4)
     
     def _hash(self, data):
         return hashlib.sha256(data.encode('utf-8')).hexdigest()
     
-    def _hmac_sign(self, data):
-        """Create HMAC signature for tamper protection"""
-        return hmac.new(self.secret_key, data.encode('utf-8'), hashlib.sha256).hexdigest()
+    def _init_hmac_pads(self):
+        """Precompute SHA-256 states for the HMAC inner and outer key pads"""
+        key = self.secret_key
+        block_size = hashlib.sha256().block_size
+        if len(key) > block_size:
+            key = hashlib.sha256(key).digest()
+        key = key.ljust(block_size, b'\0')
+        
+        self._ipad = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+        self._opad = hashlib.sha256(bytes(b ^ 0x5c for b in key))
     
-    def calculate_age(self, birth_date):
-        today = date.today()
-        age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
-        return age
+    def _hmac_sign(self, data):
+        """Create HMAC signature over canonical proof bytes"""
+        inner = self._ipad.copy()
+        inner.update(data)
+        outer = self._opad.copy()
+        outer.update(inner.digest())
+        return outer.hexdigest()
     
-    def generate_secure_age_proof(self, birth_date_str, user_id):
+    def generate_secure_age_proof(self, birth_date_str, user_id, *, now=None):
         """Generate secure ZK proof for age verification"""
-        birth_date = datetime.strptime(birth_date_str, "%Y-%m-%d").date()
-        age = self.calculate_age(birth_date)
+        now = now or datetime.now()
+        if not BIRTH_DATE_RE.fullmatch(birth_date_str):
+            raise ValueError(f"Invalid birth date {birth_date_str!r}, expected YYYY-MM-DD")
+        birth_year = int(birth_date_str[0:4])
+        birth_month = int(birth_date_str[5:7])
+        birth_day = int(birth_date_str[8:10])
+        date(birth_year, birth_month, birth_day)  # reject impossible dates
+        
+        # Whole years since birth, one less if this year's birthday hasn't come yet
+        age = now.year - birth_year - ((now.month, now.day) < (birth_month, birth_day))
         
         # Generate unique alias
         alias = self._generate_alias()
@@ -58,12 +139,12 @@ class SecureAgeZKProof:
             "user_id": user_id,
             "age_verified": age >= self.min_age,
             "min_age": self.min_age,
-            "timestamp": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(hours=self.proof_expiry_hours)).isoformat()
+            "timestamp": now.isoformat(),
+            "expires_at": (now + timedelta(hours=self.proof_expiry_hours)).isoformat()
         }
         
         # Create signature
-        data_to_sign = json.dumps(proof_data, sort_keys=True)
+        data_to_sign = self._SIGN_FMT.format(**proof_data).encode('utf-8')
         signature = self._hmac_sign(data_to_sign)
         
         # Add signature to proof
@@ -80,8 +161,14 @@ class SecureAgeZKProof:
                 return False, "Proof expired"
             
             # Verify signature
-            signature = proof_data.pop("signature")
-            data_to_verify = json.dumps(proof_data, sort_keys=True)
+            signature = proof_data["signature"]
+            data_to_verify = self._SIGN_FMT.format(**proof_data).encode('utf-8')
+            
+            # Replayed proofs skip the HMAC if the signed fields are unchanged
+            cached = self._get_cached_verification(signature, data_to_verify)
+            if cached is not None:
+                return cached
+            
             expected_signature = self._hmac_sign(data_to_verify)
             
             if not hmac.compare_digest(signature, expected_signature):
@@ -89,29 +176,79 @@ class SecureAgeZKProof:
             
             # Check age requirement
             if not proof_data["age_verified"]:
-                return False, "Age requirement not met"
+                result = (False, "Age requirement not met")
+            else:
+                result = (True, "Proof verified successfully")
             
-            return True, "Proof verified successfully"
+            self._cache_verification(signature, data_to_verify, result)
+            return result
             
         except Exception as e:
             return False, f"Verification failed: {str(e)}"
     
-    def generate_qr_code(self, proof_data):
-        """Generate QR code with unique alias and store in dedicated folder"""
-        alias = proof_data["alias"]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    def _get_cached_verification(self, signature, signed_data):
+        """Return the cached result for a previously verified proof, if any"""
+        with self._verify_lock:
+            entry = self._verify_cache.get(signature)
+            if entry is None or entry[0] != signed_data:
+                return None
+            self._verify_cache.move_to_end(signature)
+            return entry[1]
+    
+    def _cache_verification(self, signature, signed_data, result):
+        """Remember a verified proof, evicting the least recently used entry"""
+        with self._verify_lock:
+            self._verify_cache[signature] = (signed_data, result)
+            self._verify_cache.move_to_end(signature)
+            if len(self._verify_cache) > self._verify_cache_max:
+                self._verify_cache.popitem(last=False)
+    
+    def _compute_qr_filename(self, alias, now=None):
+        """Build the QR code filepath for an alias"""
+        timestamp = (now or datetime.now()).strftime("%Y%m%d_%H%M%S")
         
         # Create filename with alias and timestamp
         filename = f"age_proof_{alias}_{timestamp}.png"
-        filepath = os.path.join(self.qr_folder, filename)
-        
-        # Generate QR code
-        qr = qrcode.QRCode(version=1, box_size=config.QR_BOX_SIZE, border=config.QR_BORDER)
-        qr.add_data(json.dumps(proof_data))
-        qr.make(fit=True)
+        return os.path.join(self.qr_folder, filename)
+    
+    def render_qr_png(self, proof_data):
+        """Encode the proof as a QR code and return the PNG bytes"""
+        qr = segno.make_qr(orjson.dumps(proof_data), error='m', boost_error=False)
+        buf = io.BytesIO()
+        qr.save(buf, kind='png', scale=config.QR_BOX_SIZE, border=config.QR_BORDER,
+                compresslevel=config.QR_COMPRESS_LEVEL)
+        return buf.getvalue()
+    
+    def qr_data_url(self, png_data):
+        """Wrap PNG bytes in a data: URL the frontend can display directly"""
+        return "data:image/png;base64," + base64.b64encode(png_data).decode('ascii')
+    
+    def _render_qr(self, proof_data, filepath):
+        """Encode the proof as a QR code PNG in memory and write it to filepath"""
+        self._write_file(filepath, self.render_qr_png(proof_data))
+    
+    def _write_file(self, filepath, data):
+        """Write data in as few syscalls as possible and publish it atomically"""
+        tmp_path = filepath + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
         
-        img = qr.make_image(fill_color="black", back_color="white")
-        img.save(filepath)
+        # Readers in other workers never see a half-written PNG
+        os.replace(tmp_path, filepath)
+    
+    def generate_qr_code(self, proof_data, *, now=None, png_data=None):
+        """Generate QR code with unique alias and store in dedicated folder"""
+        alias = proof_data["alias"]
+        filepath = self._compute_qr_filename(alias, now)
+        if png_data is None:
+            self._render_qr(proof_data, filepath)
+        else:
+            self._write_file(filepath, png_data)
         
         return filepath, alias
 